@@ -1,11 +1,18 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
-from sqlalchemy import create_engine
-import plotly.express as px
+from sqlalchemy import create_engine, text
+import plotly.graph_objects as go
 
 st.set_page_config(page_title="Apache Logs Dashboard", layout="wide")
 
 DB_PATH = "apache_logs.db"
+RAW_PARQUET_PATH = "apache_logs_raw.parquet"
+RAW_COLUMNS = ["timestamp", "ip", "path", "status", "hour", "status_class", "is_error"]
+# نفس الأنواع المحفوظة في Parquet، SQLite يرجعها int64 عادي
+RAW_DTYPES = {"ip": "category", "path": "category", "status": "uint16", "status_class": "uint8", "is_error": bool}
+# لون ثابت لكل فئة عشان الألوان ما تتغير حسب الفئات الموجودة
+STATUS_CLASS_COLORS = {"1xx": "#BFDBFE", "2xx": "#2563EB", "3xx": "#60A5FA", "4xx": "#93C5FD", "5xx": "#1E3A8A"}
 
 
 # =========================
@@ -54,12 +61,159 @@ else:
     chart_theme = "plotly_white"
 
 
+@st.cache_resource
+def get_engine():
+    return create_engine(f"sqlite:///{DB_PATH}")
+
+
+@st.cache_data
+def load_summary():
+    return pd.read_parquet("summary.parquet")
+
+
+# كل تركيبة فلاتر لها نسخة في الكاش، فنحدد العدد عشان IPs كثيرة ما تكبر الذاكرة بلا حد
+FILTER_CACHE_ENTRIES = 64
+
+# الفلاتر تنحسب داخل SQLite عشان ما نسحب إلا الصفوف المطابقة
+FILTERED_COLUMNS = "timestamp, ip, path, status, hour, status_class, is_error"
+
+
+def build_filtered_query(columns, status=None, path=None, ip=None):
+    # بس الفلاتر المفعّلة تدخل الـ WHERE؛ شرط مثل (:x IS NULL OR col = :x) يمنع SQLite من استخدام الـ index
+    clauses, params = [], {}
+    for col, value in (("status", status), ("path", path), ("ip", ip)):
+        if value is not None:
+            clauses.append(f"{col} = :{col}")
+            params[col] = value
+
+    query = f"SELECT {columns} FROM apache_logs_raw"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    return query, params
+
+
+@st.cache_data
+def load_raw():
+    # بدون فلاتر نقرأ Parquet (أعمدة مضغوطة وأنواعها محفوظة) بدل SQLite
+    return pd.read_parquet(RAW_PARQUET_PATH, columns=RAW_COLUMNS)
+
+
+# ما نخزن الصفوف المفلترة: filtered_kpis هو اللي ينخزن، ونسخة كاملة لكل فلتر تكبر الذاكرة بدون فايدة
+def load_filtered(status=None, path=None, ip=None):
+    if status is None and path is None and ip is None:
+        return load_raw()
+
+    query, params = build_filtered_query(FILTERED_COLUMNS, status, path, ip)
+    df = pd.read_sql(text(query), get_engine(), params=params, parse_dates=["hour"])
+    return df.astype(RAW_DTYPES)
+
+
+# المعاينة تحتاج 30 صف بس، فنخلي SQLite يوقف عندها بدل ما نحمل كل الصفوف المطابقة
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def load_preview(status=None, path=None, ip=None, limit=30):
+    # المعاينة تعرض السطر كامل (method/proto/size كمان)، مو بس أعمدة الـ KPIs
+    query, params = build_filtered_query("*", status, path, ip)
+    params["limit"] = limit
+    df = pd.read_sql(text(query + " LIMIT :limit"), get_engine(), params=params, parse_dates=["hour"])
+    return df.astype(RAW_DTYPES)
+
+
 @st.cache_data
-def load_tables():
-    engine = create_engine(f"sqlite:///{DB_PATH}")
-    summary = pd.read_sql("SELECT * FROM summary", engine)
-    raw = pd.read_sql("SELECT * FROM apache_logs_raw", engine)
-    return summary, raw
+def filter_options():
+    raw = load_filtered()
+    # ip/path محفوظة category من main.py، فالقيم الفريدة مرتبة جاهزة في categories
+    # status رقم صغير (< 1000)، فـ bincount يطلع القيم الموجودة مرتبة بدون sort
+    status_values = np.flatnonzero(np.bincount(raw["status"].to_numpy())).tolist()
+    return status_values, raw["path"].cat.categories.tolist(), raw["ip"].cat.categories.tolist()
+
+
+# جداول مجمّعة جاهزة من main.py نستخدمها لما ما فيه فلاتر
+AGGREGATE_TABLES = ("requests_by_hour", "errors_by_hour", "errors_by_path", "errors_by_ip")
+
+
+@st.cache_data
+def load_aggregate(table):
+    if table not in AGGREGATE_TABLES:
+        raise ValueError(f"Unknown aggregate table: {table}")
+    return pd.read_parquet(f"{table}.parquet")
+
+
+@st.cache_data
+def load_hourly():
+    req_by_hour = load_aggregate("requests_by_hour").rename(columns={"request_count": "requests"})
+    err_by_hour = load_aggregate("errors_by_hour").rename(columns={"error_count": "errors"})
+    merged = pd.merge(req_by_hour, err_by_hour, on="hour", how="left").fillna(0)
+    return merged.sort_values("hour")
+
+
+@st.cache_data
+def load_top_errors(col):
+    table = load_aggregate(f"errors_by_{col}")
+    return (
+        table.groupby(col, as_index=False, observed=True)["error_count"].sum()
+        .sort_values("error_count", ascending=False)
+    )
+
+
+def count_errors(series):
+    counts = series.value_counts()
+    # value_counts على category يرجع حتى القيم اللي ما ظهرت بعدد 0
+    counts = counts[counts > 0]
+    return counts.reset_index(name="error_count")
+
+
+# كل الحسابات هنا مخزنة حسب الفلاتر، فتغيير الثيم أو Top N ما يعيدها
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def filtered_kpis(status=None, path=None, ip=None):
+    df = load_filtered(status, path, ip)
+    no_filters = status is None and path is None and ip is None
+
+    total_requests = len(df)
+    # ماسك واحد للأخطاء نعيد استخدامه بدل ما نفلتر df كل مرة
+    err_mask = df["is_error"].to_numpy()
+    total_errors = int(err_mask.sum())
+
+    # status_class رقم واحد (1..5)، فـ bincount يكفي بدل hash table حق value_counts
+    class_counts = np.bincount(df["status_class"].to_numpy(), minlength=6)
+    classes = np.flatnonzero(class_counts)
+    status_dist = pd.DataFrame({
+        "status_class": [f"{c}xx" for c in classes],
+        "count": class_counts[classes],
+    })
+
+    if no_filters:
+        # بدون فلاتر الأرقام الإجمالية جاهزة في summary من الـ ETL
+        summary = load_summary().iloc[0]
+        total_requests = int(summary["total_requests"])
+        errors_4xx = int(summary["errors_4xx"])
+        errors_5xx = int(summary["errors_5xx"])
+        hourly = load_hourly()
+        top_paths = load_top_errors("path")
+        top_ips = load_top_errors("ip")
+    else:
+        errors_4xx = int(class_counts[4])
+        errors_5xx = int(class_counts[5])
+        hours = df["hour"]
+        req_by_hour = hours.value_counts(sort=False).reset_index(name="requests")
+        err_by_hour = hours[err_mask].value_counts(sort=False).reset_index(name="errors")
+        hourly = pd.merge(req_by_hour, err_by_hour, on="hour", how="left").fillna(0)
+        hourly = hourly.sort_values("hour")
+
+        err_df = df.loc[err_mask]
+        top_paths = count_errors(err_df["path"])
+        top_ips = count_errors(err_df["ip"])
+
+    return {
+        "total_requests": total_requests,
+        "errors_4xx": errors_4xx,
+        "errors_5xx": errors_5xx,
+        "total_errors": total_errors,
+        "most_common_status": int(df["status"].mode().iloc[0]) if total_requests else 0,
+        "status_dist": status_dist,
+        "hourly": hourly,
+        "top_paths": top_paths,
+        "top_ips": top_ips,
+    }
 
 
 # =========================
@@ -70,53 +224,46 @@ st.caption("White/Blue Theme • Filters • KPIs • Trends • Alerts")
 
 # Load
 try:
-    summary, raw = load_tables()
+    status_values, path_values, ip_values = filter_options()
 except Exception as e:
     st.error(f"ما قدرت أفتح قاعدة البيانات: {e}")
     st.info("شغّلي أول: python main.py  عشان ينشأ apache_logs.db والجداول.")
     st.stop()
 
-# Make sure types
-raw["status"] = raw["status"].astype(int)
-raw["status_class"] = (raw["status"] // 100).astype(int)
-raw["is_error"] = raw["status"] >= 400
-
 # =========================
 # Sidebar Filters
 # =========================
 st.sidebar.header("🔎 Filters")
 
-status_options = ["All"] + sorted(raw["status"].unique().tolist())
+status_options = ["All"] + status_values
 selected_status = st.sidebar.selectbox("Status Code", status_options, index=0)
 
-path_options = ["All"] + sorted(raw["path"].unique().tolist())
+path_options = ["All"] + path_values
 selected_path = st.sidebar.selectbox("Path", path_options, index=0)
 
-ip_options = ["All"] + sorted(raw["ip"].unique().tolist())
+ip_options = ["All"] + ip_values
 selected_ip = st.sidebar.selectbox("IP", ip_options, index=0)
 
 top_n = st.sidebar.slider("Top N", min_value=3, max_value=20, value=10)
 
 # Apply filters
-df = raw.copy()
-if selected_status != "All":
-    df = df[df["status"] == int(selected_status)]
-if selected_path != "All":
-    df = df[df["path"] == selected_path]
-if selected_ip != "All":
-    df = df[df["ip"] == selected_ip]
+status_filter = None if selected_status == "All" else int(selected_status)
+path_filter = None if selected_path == "All" else selected_path
+ip_filter = None if selected_ip == "All" else selected_ip
+
+kpis = filtered_kpis(status_filter, path_filter, ip_filter)
 
 # =========================
 # KPIs (filtered)
 # =========================
-total_requests = len(df)
-errors_4xx = (df["status_class"] == 4).sum()
-errors_5xx = (df["status_class"] == 5).sum()
-total_errors = (df["status"] >= 400).sum()
+total_requests = kpis["total_requests"]
+errors_4xx = kpis["errors_4xx"]
+errors_5xx = kpis["errors_5xx"]
+total_errors = kpis["total_errors"]
 
 error_rate = (total_errors / total_requests * 100) if total_requests else 0.0
 success_rate = 100 - error_rate
-most_common_status = int(df["status"].mode().iloc[0]) if total_requests else 0
+most_common_status = kpis["most_common_status"]
 
 # Alerts
 if errors_5xx >= 3:
@@ -145,45 +292,34 @@ left, right = st.columns([1, 1])
 with left:
     st.subheader("🥧 Status Distribution (2xx / 4xx / 5xx)")
     if total_requests:
-        status_dist = df["status_class"].value_counts().reset_index()
-        status_dist.columns = ["status_class", "count"]
-        status_dist["status_class"] = status_dist["status_class"].astype(str) + "xx"
-
-        fig_pie = px.pie(
-            status_dist,
-            names="status_class",
-            values="count",
-            template=chart_theme,
-            color_discrete_sequence=["#2563EB", "#93C5FD", "#1E3A8A"]
-        )
-        fig_pie.update_traces(textposition="inside", textinfo="percent+label")
-        st.plotly_chart(fig_pie, use_container_width=True)
+        status_dist = kpis["status_dist"]
+
+        fig_pie = go.Figure(go.Pie(
+            labels=status_dist["status_class"],
+            values=status_dist["count"],
+            marker_colors=[STATUS_CLASS_COLORS.get(c, "#1E40AF") for c in status_dist["status_class"]],
+            textposition="inside",
+            textinfo="percent+label",
+        ), layout=dict(template=chart_theme))
+        st.plotly_chart(fig_pie, use_container_width=True, key="pie_status")
     else:
         st.info("لا توجد بيانات بعد تطبيق الفلاتر.")
 
 with right:
     st.subheader("⏱️ Requests vs Errors by Hour")
     if total_requests:
-        by_hour = df.copy()
-        by_hour["hour"] = by_hour["hour"].astype(str)
-
-        req_by_hour = by_hour.groupby("hour").size().reset_index(name="requests")
-        err_by_hour = by_hour[by_hour["status"] >= 400].groupby("hour").size().reset_index(name="errors")
-        merged = pd.merge(req_by_hour, err_by_hour, on="hour", how="left").fillna(0)
-        merged = merged.sort_values("hour")
-
-        fig_line = px.line(
-            merged,
-            x="hour",
-            y=["requests", "errors"],
-            template=chart_theme
-        )
+        merged = kpis["hourly"]
+
+        # Scattergl يرسم على WebGL canvas وحدة بدل عناصر SVG لكل نقطة
         # ألوان أبيض/أزرق + أحمر للأخطاء
-        fig_line.update_traces(line=dict(width=3))
-        fig_line.data[0].name = "requests"
-        fig_line.data[1].name = "errors"
-        # plotly لا يضمن ترتيب الألوان دائماً، لكن هذا غالباً كافي
-        st.plotly_chart(fig_line, use_container_width=True)
+        fig_line = go.Figure([
+            go.Scattergl(x=merged["hour"], y=merged["requests"], mode="lines", name="requests",
+                         line=dict(width=3, color="#2563EB")),
+            go.Scattergl(x=merged["hour"], y=merged["errors"], mode="lines", name="errors",
+                         line=dict(width=3, color="#DC2626")),
+        ], layout=dict(template=chart_theme))
+        # key ثابت عشان Streamlit يحدّث نفس الرسم بدل ما يبنيه من جديد
+        st.plotly_chart(fig_line, use_container_width=True, key="line_hour")
 
         st.dataframe(merged, use_container_width=True)
     else:
@@ -194,51 +330,37 @@ st.divider()
 # =========================
 # Top Error Paths / IPs
 # =========================
-err_df = df[df["status"] >= 400].copy()
-
 colA, colB = st.columns(2)
 
 with colA:
     st.subheader("🚨 Top Error Paths")
-    if len(err_df):
-        top_paths = (
-            err_df.groupby("path").size()
-            .reset_index(name="error_count")
-            .sort_values("error_count", ascending=False)
-        )
-        st.dataframe(top_paths.head(top_n), use_container_width=True)
-
-        fig_bar_paths = px.bar(
-            top_paths.head(top_n),
-            x="path",
-            y="error_count",
-            template=chart_theme,
-            title=None
-        )
-        fig_bar_paths.update_traces(marker_color="#2563EB")
-        st.plotly_chart(fig_bar_paths, use_container_width=True)
+    if total_errors:
+        top_paths = kpis["top_paths"].head(top_n)
+        st.dataframe(top_paths, use_container_width=True)
+
+        fig_bar_paths = go.Figure(go.Bar(
+            x=top_paths["path"],
+            y=top_paths["error_count"],
+            marker_color="#2563EB",
+        ), layout=dict(template=chart_theme))
+        fig_bar_paths.update_layout(xaxis_title="path", yaxis_title="error_count")
+        st.plotly_chart(fig_bar_paths, use_container_width=True, key="bar_paths")
     else:
         st.info("لا توجد أخطاء (4xx/5xx) مع الفلاتر الحالية.")
 
 with colB:
     st.subheader("🧑‍💻 Top Error IPs")
-    if len(err_df):
-        top_ips = (
-            err_df.groupby("ip").size()
-            .reset_index(name="error_count")
-            .sort_values("error_count", ascending=False)
-        )
-        st.dataframe(top_ips.head(top_n), use_container_width=True)
-
-        fig_bar_ips = px.bar(
-            top_ips.head(top_n),
-            x="ip",
-            y="error_count",
-            template=chart_theme,
-            title=None
-        )
-        fig_bar_ips.update_traces(marker_color="#93C5FD")
-        st.plotly_chart(fig_bar_ips, use_container_width=True)
+    if total_errors:
+        top_ips = kpis["top_ips"].head(top_n)
+        st.dataframe(top_ips, use_container_width=True)
+
+        fig_bar_ips = go.Figure(go.Bar(
+            x=top_ips["ip"],
+            y=top_ips["error_count"],
+            marker_color="#93C5FD",
+        ), layout=dict(template=chart_theme))
+        fig_bar_ips.update_layout(xaxis_title="ip", yaxis_title="error_count")
+        st.plotly_chart(fig_bar_ips, use_container_width=True, key="bar_ips")
     else:
         st.info("لا توجد أخطاء (4xx/5xx) مع الفلاتر الحالية.")
 
@@ -248,7 +370,7 @@ st.divider()
 # Raw Logs Preview
 # =========================
 st.subheader("📄 Raw Logs Preview (Filtered)")
-st.dataframe(df.head(30), use_container_width=True)
+st.dataframe(load_preview(status_filter, path_filter, ip_filter), use_container_width=True)
 
 st.markdown("---")
 st.caption("Built with Streamlit + SQLite | Apache Log Monitoring Dashboard")
@@ -1,105 +1,210 @@
 import re
+import sqlite3
+from contextlib import closing
+from itertools import islice
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+import pyarrow as pa
 
 import sys
 LOG_PATH = sys.argv[1] if len(sys.argv) > 1 else "logs/app.log"
 
 
-LOG_RE = re.compile(
-    r'^(?P<ip>\S+) \S+ \S+ \[(?P<ts>[^\]]+)\] "(?P<method>\S+) (?P<path>\S+) (?P<proto>[^"]+)" (?P<status>\d{3}) (?P<size>\S+)$'
+# journal_mode=MEMORY مو WAL: القاعدة ملف ناتج يقرأه الداشبورد، وWAL يبقى محفوظ في الملف
+SQLITE_BULK_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-200000",
 )
 
-def extract_apache_logs(path: str) -> pd.DataFrame:
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line_no, line in enumerate(f, start=1):
-            line = line.strip()
-            if not line:
-                continue
+CHUNK_LINES = 200_000
+ARROW_STRING = pd.ArrowDtype(pa.string())
 
-            m = LOG_RE.match(line)
-            if not m:
-                print(f"⚠️ سطر غير مطابق (line {line_no}): {line}")
-                continue
+LOG_RE = re.compile(
+    r'^(?P<ip>\S+) \S+ \S+ \[(?P<ts>[^\]]+)\] "(?P<method>\S+) (?P<path>\S+) (?P<proto>[^"]+)" (?P<status>[0-9]{3}) (?P<size>\S+)$'
+)
 
-            d = m.groupdict()
-            d["size"] = int(d["size"]) if d["size"].isdigit() else 0
-            d["status"] = int(d["status"])
-            rows.append(d)
+# السطر العادي 10 أجزاء بينها مسافة وحدة:
+# ip ident user [dd/Mon/yyyy:HH:MM:SS +zzzz] "METHOD path proto" status size
+LOG_FIELD_COUNT = 10
+# أي مسافة غير " " (tab وغيره) تخلي السطر يروح لـ LOG_RE
+OTHER_WHITESPACE = "[\t\n\v\f\r\x1c-\x1f\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]"
+
+def split_log_lines(lines: pd.Series) -> pd.DataFrame:
+    # نقسم على المسافات بدل regex، ونقبل بس الأسطر اللي أجزاؤها تطابق شروط LOG_RE بالضبط
+    parts = lines.str.split(" ")
+    parts = parts[(parts.list.len() == LOG_FIELD_COUNT) & ~lines.str.contains(OTHER_WHITESPACE)]
+    f = [parts.list[i] for i in range(LOG_FIELD_COUNT)]
+    valid = (
+        (f[0] != "") & (f[1] != "") & (f[2] != "")
+        & f[3].str.startswith("[") & ~f[3].str.contains("]", regex=False)
+        & f[4].str.endswith("]") & ~f[4].str.slice(0, -1).str.contains("]", regex=False)
+        & f[5].str.startswith('"') & (f[5].str.len() > 1)
+        & (f[6] != "")
+        & f[7].str.endswith('"') & (f[7].str.len() > 1) & ~f[7].str.slice(0, -1).str.contains('"', regex=False)
+        & f[8].str.fullmatch(r"[0-9]{3}")
+        & (f[9] != "")
+    )
+    return pd.DataFrame({
+        "ip": f[0],
+        "ts": f[3].str.slice(1) + " " + f[4].str.slice(0, -1),
+        "method": f[5].str.slice(1),
+        "path": f[6],
+        "proto": f[7].str.slice(0, -1),
+        "status": f[8],
+        "size": f[9],
+    })[valid]
+
+def parse_log_lines(lines: pd.Series) -> pd.DataFrame:
+    lines = lines.str.strip()
+    lines = lines[lines != ""]
+
+    df = split_log_lines(lines)
+
+    # الأسطر القليلة اللي ما تمشي على الشكل العادي (مثل proto فيه مسافة) نطبق عليها LOG_RE
+    rest = lines[~lines.index.isin(df.index)].astype(str)
+    if len(rest):
+        extracted = rest.str.extract(LOG_RE, expand=True)
+        unmatched = extracted["ip"].isna()
+        for line_no, line in rest[unmatched].items():
+            print(f"⚠️ سطر غير مطابق (line {line_no}): {line}")
+        df = pd.concat([df.astype(str), extracted[~unmatched]]).sort_index()
+
+    df = df.reset_index(drop=True)
+    df["status"] = pd.to_numeric(df["status"], downcast="integer")
+    # size ممكن يكون "-" لما ما فيه body
+    df["size"] = pd.to_numeric(df["size"].where(df["size"].str.fullmatch(r"[0-9]+"), "0")).astype("int64")
+    return df
 
-    return pd.DataFrame(rows)
+def extract_apache_logs(path: str) -> pd.DataFrame:
+    chunks = []
+    line_no = 1
+    # نقرأ الملف على دفعات عشان ما نحمل كل الأسطر النصية في الذاكرة مرة وحدة
+    with open(path, "r", encoding="utf-8") as f:
+        while batch := list(islice(f, CHUNK_LINES)):
+            # رقم السطر هو الـ index عشان رسائل التحذير
+            # نوع Arrow عشان split يرجع list Arrow ونقدر نوصل للأجزاء بدون Python لكل سطر
+            lines = pd.Series(batch, index=range(line_no, line_no + len(batch)), dtype=ARROW_STRING)
+            line_no += len(batch)
+            chunks.append(parse_log_lines(lines))
+
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def classify_status(status: np.ndarray):
+    # status نقرأه مرة وحدة؛ is_error ينحسب من مصفوفة status_class الصغيرة (uint8)
+    status_class = (status // 100).astype(np.uint8)
+    return status_class, status_class >= 4
 
 def transform_apache_logs(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         raise ValueError("❌ ما انقرأ ولا سطر. تأكدي أن app.log بصيغة Apache.")
 
-    df["timestamp"] = pd.to_datetime(df["ts"], format="%d/%b/%Y:%H:%M:%S %z", errors="coerce")
+    # cache=True: نفس الثانية تتكرر كثير في اللوقات فنحلل كل قيمة فريدة مرة وحدة
+    df["timestamp"] = pd.to_datetime(df["ts"], format="%d/%b/%Y:%H:%M:%S %z", cache=True, errors="coerce")
     df = df.dropna(subset=["timestamp"])
 
-    df["hour"] = df["timestamp"].dt.strftime("%Y-%m-%d %H:00:00")
-    df["status_class"] = (df["status"] // 100).astype(int)
-    df["is_error"] = df["status"] >= 400
+    # floor عملية رقمية على الـ datetime بدل strftime لكل صف (نخزن وقت الساعة المحلي بدون tz)
+    df["hour"] = df["timestamp"].dt.floor("h").dt.tz_localize(None)
+    # أصغر أنواع رقمية تكفي القيم: status < 1000 و status_class رقم واحد
+    df["status"] = df["status"].astype("uint16")
+    df["size"] = pd.to_numeric(df["size"], downcast="unsigned")
+    df["status_class"], df["is_error"] = classify_status(df["status"].to_numpy())
+
+    # category = أكواد رقمية + قاموس، فالـ groupby يشتغل على أرقام بدل نصوص
+    for c in ("ip", "path", "method", "proto"):
+        df[c] = df[c].astype("category")
 
     return df[["timestamp", "ip", "method", "path", "proto", "status", "status_class", "size", "hour", "is_error"]]
 
 def build_kpis(df: pd.DataFrame):
     total_requests = len(df)
-    errors_4xx = (df["status_class"] == 4).sum()
-    errors_5xx = (df["status_class"] == 5).sum()
+    status_class = df["status_class"].to_numpy()
+    err_mask = df["is_error"].to_numpy()
+    errors_4xx = np.count_nonzero(status_class == 4)
+    errors_5xx = np.count_nonzero(status_class == 5)
+    total_errors = np.count_nonzero(err_mask)
 
-    errors = df[df["is_error"]].copy()
+    # نأخذ بس الأعمدة اللي تحتاجها التجميعات بدل نسخة كاملة من صفوف الأخطاء
+    errors = df.loc[err_mask, ["path", "ip", "hour", "status_class"]]
 
     errors_by_path = (
-        errors.groupby("path").size()
+        errors.groupby(["path", "status_class"], observed=True).size()
         .reset_index(name="error_count")
         .sort_values("error_count", ascending=False)
     )
 
     errors_by_ip = (
-        errors.groupby("ip").size()
+        errors.groupby(["ip", "status_class"], observed=True).size()
         .reset_index(name="error_count")
         .sort_values("error_count", ascending=False)
     )
 
     errors_by_hour = (
-        errors.groupby("hour").size()
+        errors["hour"].value_counts(sort=False)
         .reset_index(name="error_count")
         .sort_values("hour")
     )
 
+    requests_by_hour = (
+        df["hour"].value_counts(sort=False)
+        .reset_index(name="request_count")
+        .sort_values("hour")
+    )
+
     summary = pd.DataFrame([{
         "total_requests": int(total_requests),
         "errors_4xx": int(errors_4xx),
         "errors_5xx": int(errors_5xx),
-        "error_rate_pct": round((len(errors) / total_requests) * 100, 2) if total_requests else 0.0
+        "error_rate_pct": round((total_errors / total_requests) * 100, 2) if total_requests else 0.0
     }])
 
-    return summary, errors_by_path, errors_by_ip, errors_by_hour
+    return summary, errors_by_path, errors_by_ip, errors_by_hour, requests_by_hour
+
+def load_and_export(df, summary, errors_by_path, errors_by_ip, errors_by_hour, requests_by_hour):
+    # sqlite3 مباشرة بدل SQLAlchemy: pandas يدخل الصفوف بـ executemany بدون معالجة لكل قيمة
+    with closing(sqlite3.connect("apache_logs.db")) as conn:
+        for pragma in SQLITE_BULK_PRAGMAS:
+            conn.execute(pragma)
 
-def load_and_export(df, summary, errors_by_path, errors_by_ip, errors_by_hour):
-    engine = create_engine("sqlite:///apache_logs.db")
+        df.to_sql("apache_logs_raw", conn, if_exists="replace", index=False, chunksize=10_000)
+        # الـ indexes بعد الإدخال، أسرع من تحديثها مع كل صف
+        with conn:
+            for col in ("status", "path", "ip", "hour"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{col} ON apache_logs_raw({col})")
 
-    df.to_sql("apache_logs_raw", engine, if_exists="replace", index=False)
-    summary.to_sql("summary", engine, if_exists="replace", index=False)
-    errors_by_path.to_sql("errors_by_path", engine, if_exists="replace", index=False)
-    errors_by_ip.to_sql("errors_by_ip", engine, if_exists="replace", index=False)
-    errors_by_hour.to_sql("errors_by_hour", engine, if_exists="replace", index=False)
+        summary.to_sql("summary", conn, if_exists="replace", index=False)
+        errors_by_path.to_sql("errors_by_path", conn, if_exists="replace", index=False)
+        errors_by_ip.to_sql("errors_by_ip", conn, if_exists="replace", index=False)
+        errors_by_hour.to_sql("errors_by_hour", conn, if_exists="replace", index=False)
+        requests_by_hour.to_sql("requests_by_hour", conn, if_exists="replace", index=False)
 
     summary.to_csv("summary.csv", index=False)
     errors_by_path.to_csv("errors_by_path.csv", index=False)
     errors_by_ip.to_csv("errors_by_ip.csv", index=False)
     errors_by_hour.to_csv("errors_by_hour.csv", index=False)
+    requests_by_hour.to_csv("requests_by_hour.csv", index=False)
+
+    # نسخة Parquet للداشبورد: قراءة عمودية أسرع من SQLite للجداول الكاملة
+    df.to_parquet("apache_logs_raw.parquet", compression="zstd", index=False)
+    summary.to_parquet("summary.parquet", compression="zstd", index=False)
+    errors_by_path.to_parquet("errors_by_path.parquet", compression="zstd", index=False)
+    errors_by_ip.to_parquet("errors_by_ip.parquet", compression="zstd", index=False)
+    errors_by_hour.to_parquet("errors_by_hour.parquet", compression="zstd", index=False)
+    requests_by_hour.to_parquet("requests_by_hour.parquet", compression="zstd", index=False)
 
 def run_pipeline():
     df = extract_apache_logs(LOG_PATH)
     df = transform_apache_logs(df)
 
-    summary, errors_by_path, errors_by_ip, errors_by_hour = build_kpis(df)
-    load_and_export(df, summary, errors_by_path, errors_by_ip, errors_by_hour)
+    summary, errors_by_path, errors_by_ip, errors_by_hour, requests_by_hour = build_kpis(df)
+    load_and_export(df, summary, errors_by_path, errors_by_ip, errors_by_hour, requests_by_hour)
 
     print("✅ تم تشغيل Apache Log Pipeline بنجاح")
-    print("📄 تم إنشاء: summary.csv و apache_logs.db")
+    print("📄 تم إنشاء: summary.csv و apache_logs.db و ملفات Parquet")
 
 if __name__ == "__main__":
     run_pipeline()